@@ -1,5 +1,8 @@
 import numpy as np
 
+# 音频长度向上补齐到这个值的倍数，减少不同输入形状的数量，让cuDNN可以复用已经选好的算法
+PAD_BUCKET_SIZE = 64
+
 
 # 对一个batch的数据处理
 def collate_fn(batch):
@@ -7,6 +10,7 @@ def collate_fn(batch):
     batch = sorted(batch, key=lambda sample: sample[0].shape[1], reverse=True)
     freq_size = batch[0][0].shape[0]
     max_audio_length = batch[0][0].shape[1]
+    max_audio_length = (max_audio_length + PAD_BUCKET_SIZE - 1) // PAD_BUCKET_SIZE * PAD_BUCKET_SIZE
     batch_size = len(batch)
     # 找出标签最长的
     batch_temp = sorted(batch, key=lambda sample: len(sample[1]), reverse=True)
@@ -1,5 +1,3 @@
-import math
-
 import numpy as np
 import random
 from tqdm import tqdm
@@ -77,28 +75,15 @@ class FeatureNormalizer(object):
             sampled_manifest = self._rng.sample(manifest, num_samples)
         dataset = NormalizerDataset(sampled_manifest, feature_method=self.feature_method)
         test_loader = DataLoader(dataset=dataset, batch_size=64, collate_fn=collate_fn, num_workers=num_workers)
-        # 求总和
-        std, means = None, None
-        number = 0
-        for std1, means1, number1 in tqdm(test_loader()):
-            number += number1
-            if means is None:
-                means = means1
-            else:
-                means += means1
-            if std is None:
-                std = std1
-            else:
-                std += std1
-        # 求总和的均值和标准值
-        for i in range(len(means)):
-            means[i] /= number
-            std[i] = std[i] / number - means[i] * means[i]
-            if std[i] < 1.0e-20:
-                std[i] = 1.0e-20
-            std[i] = math.sqrt(std[i])
+        # 用Chan的并行算法合并每个batch的数量、均值和平方差和
+        number, means, m2 = 0, None, None
+        for number1, means1, m21 in tqdm(test_loader()):
+            number, means, m2 = merge_mean_m2(number, means, m2, int(number1),
+                                              np.array(means1, dtype='float64'), np.array(m21, dtype='float64'))
+        # 求方差和标准值
+        var = np.maximum(m2 / number, 1.0e-20)
         self.mean = means.reshape([-1, 1])
-        self.std = std.reshape([-1, 1])
+        self.std = np.sqrt(var).reshape([-1, 1])
 
 
 class NormalizerDataset(Dataset):
@@ -118,19 +103,26 @@ class NormalizerDataset(Dataset):
         return len(self.sampled_manifest)
 
 
+def merge_mean_m2(number_a, mean_a, m2_a, number_b, mean_b, m2_b):
+    """合并两组数据的数量、均值和平方差和
+
+    :return: 合并后的数量、均值和平方差和
+    :rtype: tuple
+    """
+    if number_a == 0:
+        return number_b, mean_b, m2_b
+    number = number_a + number_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * number_b / number
+    m2 = m2_a + m2_b + np.square(delta) * number_a * number_b / number
+    return number, mean, m2
+
+
 def collate_fn(features):
-    std, means = None, None
-    number = 0
+    number, means, m2 = 0, None, None
     for feature, _ in features:
-        number += feature.shape[1]
-        sums = np.sum(feature, axis=1)
-        if means is None:
-            means = sums
-        else:
-            means += sums
-        square_sums = np.sum(np.square(feature), axis=1)
-        if std is None:
-            std = square_sums
-        else:
-            std += square_sums
-    return std, means, number
+        feature = feature.astype('float64')
+        mean = np.mean(feature, axis=1)
+        square_sums = np.sum(np.square(feature - mean[:, None]), axis=1)
+        number, means, m2 = merge_mean_m2(number, means, m2, feature.shape[1], mean, square_sums)
+    return number, means, m2
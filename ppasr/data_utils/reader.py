@@ -19,6 +19,8 @@ class PPASRDataset(Dataset):
         self._normalizer = FeatureNormalizer(mean_std_filepath, feature_method=feature_method)
         self._augmentation_pipeline = AugmentationPipeline(augmentation_config=augmentation_config)
         self._speech_featurizer = SpeechFeaturizer(vocab_filepath=vocab_filepath, feature_method=feature_method)
+        # 词汇表的numpy数组，用于批量把索引转换为字符
+        self.vocab_array = np.array(self.vocab_list, dtype=object)
         # 获取数据列表
         with open(data_list, 'r', encoding='utf-8') as f:
             lines = f.readlines()
@@ -1,5 +1,6 @@
 import os
 
+from ppasr.decoders.ctc_batch_beam_search import BatchedCTCBeamSearch
 from ppasr.decoders.swig_wrapper import Scorer
 from ppasr.decoders.swig_wrapper import ctc_beam_search_decoder_batch, ctc_beam_search_decoder
 
@@ -23,6 +24,8 @@ class BeamSearchDecoder:
               "is_character_based = %d," % lm_char_based +
               " max_order = %d," % lm_max_order +
               " dict_size = %d" % lm_dict_size)
+        # 设备上的批量解码器只支持字符级的语言模型，只创建一次
+        self._batch_decoder = BatchedCTCBeamSearch(vocab_list, self._ext_scorer) if lm_char_based else None
         print("初始化解码器完成!")
         print('=' * 70)
 
@@ -60,3 +63,20 @@ class BeamSearchDecoder:
                                                             blank_id=blank_id)
         results = [result[0][1] for result in beam_search_results]
         return results
+
+    # 是否支持在设备上批量解码
+    @property
+    def support_batch_paddle(self):
+        return self._batch_decoder is not None
+
+    # 一批数据在设备上批量解码
+    def decode_batch_beam_search_paddle(self, log_probs, log_probs_lens, beam_alpha, beam_beta,
+                                        beam_size, cutoff_prob, cutoff_top_n, blank_id=0):
+        return self._batch_decoder.decode(log_probs=log_probs,
+                                          log_probs_lens=log_probs_lens,
+                                          beam_alpha=beam_alpha,
+                                          beam_beta=beam_beta,
+                                          beam_size=beam_size,
+                                          cutoff_prob=cutoff_prob,
+                                          cutoff_top_n=cutoff_top_n,
+                                          blank_id=blank_id)
@@ -0,0 +1,254 @@
+import numpy as np
+import paddle
+
+__all__ = ['BatchedCTCBeamSearch']
+
+# 前缀哈希使用的两组乘数和模数，两个31位哈希同时相等才认为是同一个前缀
+_HASH_PARAMS = ((1000003, 2147483647), (999983, 2147483629))
+
+
+def _log_add(a, b):
+    """逐元素计算log(exp(a) + exp(b))，两个都是-inf时结果为-inf"""
+    m = paddle.maximum(a, b)
+    is_inf = paddle.isinf(m)
+    safe_m = paddle.where(is_inf, paddle.zeros_like(m), m)
+    # 部分CPU实现向量化计算exp(-inf)时得到的不是0，所以两个都是-inf时直接返回-inf
+    return paddle.where(is_inf, m, safe_m + paddle.log(paddle.exp(a - safe_m) + paddle.exp(b - safe_m)))
+
+
+class BatchedCTCBeamSearch(object):
+    """在设备上批量执行的CTC前缀集束搜索解码器
+
+    执行标准的CTC前缀集束搜索：每个前缀分别记录以空白结尾和以非空白结尾的概率，折叠后相同的路径会合并概率，
+    语言模型得分在选取TopK之前加入。整个批次的所有集束在每个时间步一起选取TopK，状态全部保存在paddle.Tensor中。
+    使用语言模型时，只对按得分上界选进TopK的扩展字符查询语言模型。
+    目前只支持字符级的语言模型，并且要求alpha不小于0
+
+    :param vocab_list: 词汇列表
+    :type vocab_list: list
+    :param ext_scorer: 外部语言模型打分器，为None时不使用语言模型
+    :type ext_scorer: Scorer
+    """
+
+    def __init__(self, vocab_list, ext_scorer=None):
+        self.vocab_list = list(vocab_list)
+        self.ext_scorer = ext_scorer
+        if ext_scorer is not None:
+            if not ext_scorer.is_character_based():
+                raise ValueError('BatchedCTCBeamSearch只支持字符级的语言模型')
+            self._lm_order = ext_scorer.get_max_order()
+
+    def decode(self, log_probs, log_probs_lens, beam_alpha, beam_beta, beam_size,
+               cutoff_prob=1.0, cutoff_top_n=40, blank_id=0):
+        """批量解码
+
+        :param log_probs: 模型输出的对数概率，shape[B, T, V]
+        :type log_probs: paddle.Tensor
+        :param log_probs_lens: 每条数据的有效长度，shape[B]
+        :type log_probs_lens: paddle.Tensor
+        :param beam_alpha: 语言模型的系数
+        :type beam_alpha: float
+        :param beam_beta: 字计数的系数
+        :type beam_beta: float
+        :param beam_size: 集束搜索的大小
+        :type beam_size: int
+        :param cutoff_prob: 剪枝的累积概率
+        :type cutoff_prob: float
+        :param cutoff_top_n: 每个时间步最多保留的字符数量
+        :type cutoff_top_n: int
+        :param blank_id: 空白标签的索引
+        :type blank_id: int
+        :return: 字符串列表
+        :rtype: list
+        """
+        if self.ext_scorer is not None and beam_alpha < 0:
+            raise ValueError('beam_alpha不能小于0')
+        log_probs = log_probs.astype(paddle.float32)
+        batch_size, max_len, vocab_size = log_probs.shape
+        lens = log_probs_lens.astype(paddle.int64).unsqueeze(-1)
+        neg_inf = float('-inf')
+        # 开始时只有一个空前缀，以空白结尾的概率为1
+        init_pb = np.full([batch_size, beam_size], neg_inf, dtype='float32')
+        init_pb[:, 0] = 0.
+        pb = paddle.to_tensor(init_pb)
+        pnb = paddle.full([batch_size, beam_size], neg_inf, dtype=paddle.float32)
+        # vocab_size表示空前缀，没有最后一个字符
+        last = paddle.full([batch_size, beam_size], vocab_size, dtype=paddle.int64)
+        # 每个前缀和它去掉最后一个字符的父前缀的哈希
+        hashes = [paddle.zeros([batch_size, beam_size], dtype=paddle.int64) for _ in _HASH_PARAMS]
+        parent_hashes = [paddle.full([batch_size, beam_size], -1, dtype=paddle.int64) for _ in _HASH_PARAMS]
+        # 扩展出最后一个字符时加上的语言模型和字计数得分，合并路径时复用
+        last_bonus = paddle.zeros([batch_size, beam_size], dtype=paddle.float32)
+        # 每个集束的语言模型上下文，也就是最后几个字符的索引，-1表示前面没有字符
+        contexts, lm_cache = None, None
+        if self.ext_scorer is not None:
+            contexts = paddle.full([batch_size, beam_size, max(self._lm_order - 1, 1)], -1, dtype=paddle.int64)
+            # 只在一次解码内缓存语言模型的对数概率，避免缓存无限增长
+            lm_cache = {}
+        label_range = paddle.arange(vocab_size, dtype=paddle.int64)
+        batch_index = paddle.arange(batch_size, dtype=paddle.int64).unsqueeze(-1).expand([batch_size, beam_size])
+        beam_index = paddle.arange(beam_size, dtype=paddle.int64).unsqueeze(0).expand([batch_size, beam_size])
+        # 扩展字符展平后的索引，最后多出一个位置给没有父前缀的集束使用
+        num_ext = batch_size * beam_size * vocab_size
+        back_beams, back_tokens = [], []
+        for t in range(max_len):
+            lp = self._cutoff(log_probs[:, t, :], cutoff_prob, cutoff_top_n)
+            p_total = _log_add(pb, pnb)
+            valid = paddle.logical_not(paddle.isinf(p_total))
+            # 当前时间步是空白，前缀不变
+            stay_pb = p_total + lp[:, blank_id].unsqueeze(-1)
+            # 重复最后一个字符，前缀不变
+            safe_last = paddle.where(last == vocab_size, paddle.zeros_like(last), last)
+            lp_last = paddle.gather_nd(lp, paddle.stack([batch_index, safe_last], axis=-1))
+            lp_last = paddle.where(last == vocab_size, paddle.full_like(lp_last, neg_inf), lp_last)
+            stay_pnb = pnb + lp_last
+            # 扩展一个新字符，和最后一个字符相同时只能从以空白结尾的路径扩展
+            is_last = label_range.reshape([1, 1, -1]) == last.unsqueeze(-1)
+            base = paddle.where(is_last,
+                                pb.unsqueeze(-1).expand([batch_size, beam_size, vocab_size]),
+                                p_total.unsqueeze(-1).expand([batch_size, beam_size, vocab_size]))
+            ext = base + lp.unsqueeze(1)
+            ext = paddle.where((label_range == blank_id).reshape([1, 1, -1]).expand(ext.shape),
+                               paddle.full_like(ext, neg_inf), ext)
+            # 扩展出的前缀已经在集束中时合并到该集束，match[b, j, k]表示集束j是集束k扩展出来的
+            match = paddle.logical_and(valid.unsqueeze(-1), valid.unsqueeze(1))
+            for h, ph in zip(hashes, parent_hashes):
+                match = paddle.logical_and(match, ph.unsqueeze(-1) == h.unsqueeze(1))
+            parent_base = paddle.where(last.unsqueeze(-1) == last.unsqueeze(1),
+                                       pb.unsqueeze(1).expand([batch_size, beam_size, beam_size]),
+                                       p_total.unsqueeze(1).expand([batch_size, beam_size, beam_size]))
+            parent_base = paddle.where(match, parent_base, paddle.full_like(parent_base, neg_inf))
+            merged = paddle.max(parent_base, axis=-1) + lp_last + last_bonus
+            stay_pnb = _log_add(stay_pnb, merged)
+            # 已经合并的扩展字符不能再作为新的前缀
+            has_parent = paddle.any(match, axis=-1)
+            parent = paddle.argmax(match.astype(paddle.int32), axis=-1)
+            merged_index = (batch_index * beam_size + parent) * vocab_size + safe_last
+            merged_index = paddle.where(has_parent, merged_index, paddle.full_like(merged_index, num_ext))
+            ext = paddle.concat([ext.reshape([-1]), paddle.full([1], neg_inf, dtype=ext.dtype)])
+            ext = paddle.scatter(ext, merged_index.reshape([-1]),
+                                 paddle.full([batch_size * beam_size], neg_inf, dtype=ext.dtype))
+            ext = ext[:num_ext].reshape([batch_size, beam_size * vocab_size])
+            stay_total = _log_add(stay_pb, stay_pnb)
+            # 加入语言模型和字计数得分后选取TopK
+            if contexts is not None:
+                scores, idx, bonus = self._lm_topk(stay_total, ext, contexts, lm_cache,
+                                                   beam_alpha, beam_beta, beam_size, vocab_size)
+            else:
+                scores, idx = paddle.topk(paddle.concat([stay_total, ext], axis=1), k=beam_size, axis=-1)
+                bonus = paddle.zeros_like(ext)
+            is_ext = idx >= beam_size
+            ext_idx = paddle.where(is_ext, idx - beam_size, paddle.zeros_like(idx))
+            src = paddle.where(is_ext, ext_idx // vocab_size, idx)
+            token = paddle.where(is_ext, ext_idx % vocab_size, paddle.full_like(idx, -1))
+            gather_index = paddle.stack([batch_index, src], axis=-1)
+            new_pb = paddle.where(is_ext, paddle.full_like(scores, neg_inf), paddle.gather_nd(stay_pb, gather_index))
+            new_pnb = paddle.where(is_ext, scores, paddle.gather_nd(stay_pnb, gather_index))
+            new_last = paddle.where(is_ext, token, paddle.gather_nd(last, gather_index))
+            new_bonus = paddle.where(is_ext, paddle.gather_nd(bonus, paddle.stack([batch_index, ext_idx], axis=-1)),
+                                     paddle.gather_nd(last_bonus, gather_index))
+            new_hashes, new_parent_hashes = [], []
+            for (mul, mod), h, ph in zip(_HASH_PARAMS, hashes, parent_hashes):
+                src_h = paddle.gather_nd(h, gather_index)
+                new_hashes.append(paddle.where(is_ext, (src_h * mul + token + 1) % mod, src_h))
+                new_parent_hashes.append(paddle.where(is_ext, src_h, paddle.gather_nd(ph, gather_index)))
+            # 超出有效长度的帧保持原来的集束不变
+            active = (lens > t).expand([batch_size, beam_size])
+            pb = paddle.where(active, new_pb, pb)
+            pnb = paddle.where(active, new_pnb, pnb)
+            last = paddle.where(active, new_last, last)
+            last_bonus = paddle.where(active, new_bonus, last_bonus)
+            hashes = [paddle.where(active, n, o) for n, o in zip(new_hashes, hashes)]
+            parent_hashes = [paddle.where(active, n, o) for n, o in zip(new_parent_hashes, parent_hashes)]
+            src = paddle.where(active, src, beam_index)
+            token = paddle.where(active, token, paddle.full_like(token, -1))
+            if contexts is not None:
+                src_contexts = paddle.gather_nd(contexts, paddle.stack([batch_index, src], axis=-1))
+                shifted = paddle.concat([src_contexts[:, :, 1:], token.unsqueeze(-1)], axis=-1)
+                contexts = paddle.where((token >= 0).unsqueeze(-1).expand(shifted.shape), shifted, src_contexts)
+            back_beams.append(src)
+            back_tokens.append(token)
+        if max_len == 0:
+            return [''] * batch_size
+        # 一次拷贝回主机后回溯得分最高的前缀
+        back_beams = paddle.stack(back_beams).numpy()
+        back_tokens = paddle.stack(back_tokens).numpy()
+        best_beam = paddle.argmax(_log_add(pb, pnb), axis=-1).numpy()
+        rows = np.arange(batch_size)
+        tokens = [[] for _ in range(batch_size)]
+        for t in range(max_len - 1, -1, -1):
+            step_tokens = back_tokens[t, rows, best_beam]
+            for b in np.nonzero(step_tokens >= 0)[0]:
+                tokens[b].append(self.vocab_list[step_tokens[b]])
+            best_beam = back_beams[t, rows, best_beam]
+        return [''.join(reversed(token)).replace('<space>', ' ') for token in tokens]
+
+    @staticmethod
+    def _cutoff(lp, cutoff_prob, cutoff_top_n):
+        """和swig解码器相同的剪枝，只保留累积概率达到cutoff_prob之前、最多cutoff_top_n个字符"""
+        vocab_size = lp.shape[-1]
+        top_n = min(cutoff_top_n, vocab_size)
+        if cutoff_prob >= 1.0 and top_n >= vocab_size:
+            return lp
+        top_lp, _ = paddle.topk(lp, k=top_n, axis=-1)
+        top_prob = paddle.exp(top_lp)
+        # 累积概率在加上当前字符之前还没有达到cutoff_prob的字符都保留
+        keep = (paddle.cumsum(top_prob, axis=-1) - top_prob) < cutoff_prob
+        threshold = paddle.min(paddle.where(keep, top_lp, paddle.full_like(top_lp, float('inf'))),
+                               axis=-1, keepdim=True)
+        return paddle.where(lp >= threshold, lp, paddle.full_like(lp, float('-inf')))
+
+    def _lm_topk(self, stay_total, ext, contexts, lm_cache, beam_alpha, beam_beta, beam_size, vocab_size):
+        """选取加上语言模型和字计数得分之后的TopK
+
+        语言模型的对数概率不大于0，所以ext + beta是扩展字符得分的上界。第一轮只对上界最高的K个扩展字符查询语言模型，
+        和不变前缀一起取第K个得分，它不会高于最终的第K个得分。第二轮只查询上界仍然高于它的扩展字符，
+        其余的扩展字符不可能进入TopK，所以结果和查询全部扩展字符一样
+        """
+        batch_size, num_ext = ext.shape
+        flat_ext = ext.reshape([-1])
+        upper = ext + beam_beta
+        exact = paddle.full_like(flat_ext, float('-inf'))
+        bonus = paddle.zeros_like(flat_ext)
+        flat_contexts = contexts.reshape([batch_size * beam_size, -1])
+        row_offset = paddle.arange(batch_size, dtype=paddle.int64).unsqueeze(-1) * num_ext
+        top_upper, top_idx = paddle.topk(upper, k=min(beam_size, num_ext), axis=-1)
+        index = paddle.masked_select(top_idx + row_offset, paddle.logical_not(paddle.isinf(top_upper)))
+        exact, bonus = self._lm_query(index, flat_ext, exact, bonus, flat_contexts, lm_cache,
+                                      beam_alpha, beam_beta, vocab_size)
+        kth, _ = paddle.topk(paddle.concat([stay_total, exact.reshape([batch_size, num_ext])], axis=1),
+                             k=beam_size, axis=-1)
+        # 没有查询过并且上界高于当前第K个得分的扩展字符
+        remain = paddle.logical_and(paddle.isinf(exact.reshape([batch_size, num_ext])), upper > kth[:, -1:])
+        index = paddle.nonzero(remain.reshape([-1])).reshape([-1])
+        exact, bonus = self._lm_query(index, flat_ext, exact, bonus, flat_contexts, lm_cache,
+                                      beam_alpha, beam_beta, vocab_size)
+        top, idx = paddle.topk(paddle.concat([stay_total, exact.reshape([batch_size, num_ext])], axis=1),
+                               k=beam_size, axis=-1)
+        return top, idx, bonus.reshape([batch_size, num_ext])
+
+    def _lm_query(self, index, flat_ext, exact, bonus, flat_contexts, lm_cache, beam_alpha, beam_beta, vocab_size):
+        """查询展平索引为index的扩展字符的语言模型，把准确得分和加上的得分写入exact和bonus"""
+        if index.shape[0] == 0:
+            return exact, bonus
+        # 展平后的索引除以词汇大小就是扩展字符所在集束的展平索引
+        query = paddle.concat([paddle.gather(flat_contexts, index // vocab_size),
+                               (index % vocab_size).unsqueeze(-1)], axis=1).numpy()
+        lm_bonus = np.array([beam_alpha * self._lm_log_prob(q, lm_cache) + beam_beta for q in query], dtype='float32')
+        lm_bonus = paddle.to_tensor(lm_bonus)
+        exact = paddle.scatter(exact, index, paddle.gather(flat_ext, index) + lm_bonus)
+        bonus = paddle.scatter(bonus, index, lm_bonus)
+        return exact, bonus
+
+    def _lm_log_prob(self, query, lm_cache):
+        """查询语言模型的对数概率，query是上下文字符的索引加上新字符的索引
+
+        和swig解码器一样，前面字符不够时用<s>补齐到语言模型的阶数
+        """
+        key = query.tobytes()
+        if key not in lm_cache:
+            chars = [self.vocab_list[i] for i in query[:-1] if i >= 0][-(self._lm_order - 1):] \
+                if self._lm_order > 1 else []
+            ngram = ['<s>'] * (self._lm_order - 1 - len(chars)) + chars + [self.vocab_list[query[-1]]]
+            lm_cache[key] = self.ext_scorer.get_log_cond_prob(ngram)
+        return lm_cache[key]
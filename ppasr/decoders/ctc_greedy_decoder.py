@@ -1,6 +1,7 @@
 from itertools import groupby
 
 import numpy as np
+import paddle
 
 
 def greedy_decoder(probs_seq, vocabulary, blank_index=0):
@@ -31,19 +32,32 @@ def greedy_decoder(probs_seq, vocabulary, blank_index=0):
     return score, text.replace('<space>', ' ')
 
 
-def greedy_decoder_batch(probs_split, vocabulary, blank_index=0):
-    """CTC贪婪(最佳路径)解码器
-    :param probs_split: 一批包含2D的概率表
-    :type probs_split: list
-    :param vocabulary: 词汇列表
-    :type vocabulary: list
+def greedy_decoder_paddle(logits, logits_lens, vocabulary, blank_index=0):
+    """在设备上执行的CTC贪婪(最佳路径)解码器
+
+    argmax和去掉连续重复、空白都在设备上完成，只把保留下来的标签索引拷贝回主机。
+    因为softmax是单调的，所以可以直接输入模型输出的logits
+
+    :param logits: 一批模型输出，shape[B, T, V]
+    :type logits: paddle.Tensor
+    :param logits_lens: 每条数据的有效长度，shape[B]
+    :type logits_lens: paddle.Tensor
+    :param vocabulary: 词汇列表或者词汇的numpy数组
+    :type vocabulary: list|numpy.ndarray
     :param blank_index 需要移除的空白索引
     :type blank_index int
     :return: 字符串列表
     :rtype: list
     """
-    results = []
-    for i, probs in enumerate(probs_split):
-        output_transcription = greedy_decoder(probs, vocabulary, blank_index=blank_index)
-        results.append(output_transcription[1])
+    batch_size, max_len = logits.shape[0], logits.shape[1]
+    ids = paddle.argmax(logits, axis=-1)
+    # 和前一个时间步不同的标签才保留
+    not_repeat = paddle.concat([paddle.ones([batch_size, 1], dtype=paddle.bool), ids[:, 1:] != ids[:, :-1]], axis=1)
+    valid = paddle.arange(max_len, dtype=paddle.int64).unsqueeze(0) < logits_lens.astype(paddle.int64).unsqueeze(-1)
+    mask = paddle.logical_and(paddle.logical_and(ids != blank_index, not_repeat), valid)
+    index_list = paddle.masked_select(ids, mask).numpy()
+    counts = paddle.sum(mask.astype(paddle.int64), axis=1).numpy()
+    # 索引列表转换为字符串
+    chars = np.take(np.asarray(vocabulary, dtype=object), index_list)
+    results = [''.join(text).replace('<space>', ' ') for text in np.split(chars, np.cumsum(counts)[:-1])]
     return results
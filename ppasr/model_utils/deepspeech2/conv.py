@@ -4,14 +4,15 @@ __all__ = ['ConvStack']
 
 
 class ConvBn(nn.Layer):
-    def __init__(self, in_channels, out_channels, kernel_size, stride, input_dim):
+    def __init__(self, in_channels, out_channels, kernel_size, stride, input_dim, data_format='NCHW'):
         super().__init__()
         self.kernel_size = kernel_size
         self.stride = stride
         self.conv = nn.Conv2D(in_channels=in_channels,
                               out_channels=out_channels,
                               kernel_size=kernel_size,
-                              stride=stride)
+                              stride=stride,
+                              data_format=data_format)
         self.act = nn.GELU()
         # self.dropout = nn.Dropout()
         self.output_dim = (input_dim - self.kernel_size) // self.stride + 1
@@ -31,20 +32,25 @@ class ConvStack(nn.Layer):
     :type feat_size: int
     :param conv_out_channels: 卷积层输出大小
     :type conv_out_channels: int
+    :param data_format: 卷积的数据格式，NHWC只在混合精度训练时更快，两种格式的参数可以通用
+    :type data_format: str
     """
 
-    def __init__(self, feat_size, conv_out_channels):
+    def __init__(self, feat_size, conv_out_channels, data_format='NCHW'):
         super().__init__()
+        self.data_format = data_format
         self.conv1 = ConvBn(in_channels=1,
                             out_channels=conv_out_channels,
                             kernel_size=3,
                             stride=2,
-                            input_dim=feat_size)
+                            input_dim=feat_size,
+                            data_format=data_format)
         self.conv2 = ConvBn(in_channels=conv_out_channels,
                             out_channels=conv_out_channels,
                             kernel_size=3,
                             stride=2,
-                            input_dim=self.conv1.output_dim)
+                            input_dim=self.conv1.output_dim,
+                            data_format=data_format)
         self.output_dim = self.conv2.output_dim * conv_out_channels
 
     def forward(self, x, x_len):
@@ -54,11 +60,19 @@ class ConvStack(nn.Layer):
         """
         # [B, D, T] -> [B, T, D]
         x = x.transpose([0, 2, 1])
-        # [B, T, D] -> [B, C=1, T, D]
-        x = x.unsqueeze(1)
-        x, x_len = self.conv1(x, x_len)
-        x, x_len = self.conv2(x, x_len)
-        # 将数据从卷积特征映射转换为向量序列
-        x = x.transpose([0, 2, 1, 3])  # [B, T, C, D]
+        if self.data_format == 'NHWC':
+            # [B, T, D] -> [B, T, D, C=1]
+            x = x.unsqueeze(-1)
+            x, x_len = self.conv1(x, x_len)
+            x, x_len = self.conv2(x, x_len)
+            # 将数据从卷积特征映射转换为向量序列，保持C*D的顺序和NCHW时一致
+            x = x.transpose([0, 1, 3, 2])  # [B, T, C, D]
+        else:
+            # [B, T, D] -> [B, C=1, T, D]
+            x = x.unsqueeze(1)
+            x, x_len = self.conv1(x, x_len)
+            x, x_len = self.conv2(x, x_len)
+            # 将数据从卷积特征映射转换为向量序列
+            x = x.transpose([0, 2, 1, 3])  # [B, T, C, D]
         x = x.reshape([0, 0, -1])  # [B, T, C*D]
         return x, x_len
\ No newline at end of file
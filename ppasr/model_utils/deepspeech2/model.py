@@ -21,17 +21,20 @@ class DeepSpeech2Model(nn.Layer):
     :type rnn_size: int
     :param use_gru: 是否使用GRU，否则使用LSTM，大数据时LSTM效果会更好一些
     :type use_gru: bool
+    :param data_format: 卷积层的数据格式，NCHW或者NHWC
+    :type data_format: str
 
     :return: DeepSpeech2模型
     :rtype: nn.Layer
     """
 
-    def __init__(self, feat_size, vocab_size, cnn_size=32, num_rnn_layers=5, rnn_size=1024, use_gru=True):
+    def __init__(self, feat_size, vocab_size, cnn_size=32, num_rnn_layers=5, rnn_size=1024, use_gru=True,
+                 data_format='NCHW'):
         super().__init__()
         self.num_rnn_layers = num_rnn_layers
         self.rnn_size = rnn_size
         # 卷积层堆
-        self.conv = ConvStack(feat_size=feat_size, conv_out_channels=cnn_size)
+        self.conv = ConvStack(feat_size=feat_size, conv_out_channels=cnn_size, data_format=data_format)
         # RNN层堆
         self.rnn = RNNStack(i_size=self.conv.output_dim, h_size=rnn_size, num_rnn_layers=num_rnn_layers, use_gru=use_gru)
         # 分类输入层
@@ -59,22 +62,24 @@ class DeepSpeech2Model(nn.Layer):
 
 
 # 获取普通的DeepSpeech模型
-def deepspeech2(feat_size, vocab_size):
+def deepspeech2(feat_size, vocab_size, data_format='NCHW'):
     model = DeepSpeech2Model(feat_size=feat_size,
                              vocab_size=vocab_size,
                              cnn_size=32,
                              num_rnn_layers=5,
                              rnn_size=1024,
-                             use_gru=True)
+                             use_gru=True,
+                             data_format=data_format)
     return model
 
 
 # 获取大的DeepSpeech模型，适合训练Wenetspeech等大数据集
-def deepspeech2_big(feat_size, vocab_size):
+def deepspeech2_big(feat_size, vocab_size, data_format='NCHW'):
     model = DeepSpeech2Model(feat_size=feat_size,
                              vocab_size=vocab_size,
                              cnn_size=32,
                              num_rnn_layers=5,
                              rnn_size=2048,
-                             use_gru=False)
+                             use_gru=False,
+                             data_format=data_format)
     return model
@@ -32,14 +32,15 @@ class Mask(nn.Layer):
 
 # 对数据归一化模型
 class Normalizer(nn.Layer):
-    def __init__(self, mean, std):
+    def __init__(self, mean, std, eps=1e-20):
         super().__init__()
-        self.mean = paddle.to_tensor(mean, dtype=paddle.float32)
-        self.std = paddle.to_tensor(std, dtype=paddle.float32)
-        self.eps = 1e-20
+        # 预先计算缩放和偏置，把(x - mean) / std合并成一次乘加
+        inv_std = 1.0 / (std + eps)
+        self.register_buffer('inv_std', paddle.to_tensor(inv_std, dtype=paddle.float32))
+        self.register_buffer('bias', paddle.to_tensor(-mean * inv_std, dtype=paddle.float32))
 
     def forward(self, x):
-        x = (x - self.mean) / (self.std + self.eps)
+        x = paddle.add(paddle.multiply(x, self.inv_std), self.bias)
         return x
 
 
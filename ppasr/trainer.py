@@ -1,3 +1,4 @@
+import inspect
 import io
 import json
 import os
@@ -21,7 +22,7 @@ from ppasr.data_utils.featurizer.text_featurizer import TextFeaturizer
 from ppasr.data_utils.normalizer import FeatureNormalizer
 from ppasr.data_utils.reader import PPASRDataset
 from ppasr.data_utils.sampler import SortagradBatchSampler, SortagradDistributedBatchSampler
-from ppasr.decoders.ctc_greedy_decoder import greedy_decoder_batch
+from ppasr.decoders.ctc_greedy_decoder import greedy_decoder_paddle
 from ppasr.model_utils.deepspeech2.model import deepspeech2, deepspeech2_big
 from ppasr.model_utils.utils import DeepSpeech2ModelExport
 from ppasr.utils.metrics import cer, wer
@@ -64,7 +65,8 @@ class PPASRTrainer(object):
         :param cutoff_prob: 剪枝的概率
         :param cutoff_top_n: 剪枝的最大值
         :param metrics_type: 计算错误方法
-        :param decoder: 结果解码方法，支持ctc_beam_search和ctc_greedy
+        :param decoder: 结果解码方法，支持ctc_beam_search、ctc_beam_search_batch和ctc_greedy，
+                        ctc_beam_search_batch在显卡上批量执行集束搜索，只支持字符级的语言模型
         :param lang_model_path: 语言模型文件路径
         """
         self.use_model = use_model
@@ -121,13 +123,13 @@ class PPASRTrainer(object):
         count_manifest(counter, self.train_manifest)
 
         count_sorted = sorted(counter.items(), key=lambda x: x[1], reverse=True)
-        with open(self.dataset_vocab, 'w', encoding='utf-8') as fout:
-            fout.write('<blank>\t-1\n')
-            for char, count in count_sorted:
-                if char == ' ': char = '<space>'
-                # 跳过指定的字符阈值，超过这大小的字符都忽略
-                if count < count_threshold: break
-                fout.write('%s\t%d\n' % (char, count))
+        lines = ['<blank>\t-1\n']
+        # 跳过指定的字符阈值，低于这大小的字符都忽略
+        lines.extend(f'{"<space>" if char == " " else char}\t{count}\n'
+                     for char, count in count_sorted if count >= count_threshold)
+        # 拼接好全部内容后一次写入
+        with open(self.dataset_vocab, 'w', encoding='utf-8', buffering=1 << 20) as fout:
+            fout.writelines(lines)
         print('数据字典生成完成！')
 
         print('=' * 70)
@@ -183,16 +185,14 @@ class PPASRTrainer(object):
         for inputs, labels, input_lens, _ in tqdm(test_loader()):
             # 执行识别
             outs, out_lens = model(inputs, input_lens)
-            outs = paddle.nn.functional.softmax(outs, 2)
             # 解码获取识别结果
-            out_strings = self.decoder_result(outs.numpy(), out_lens, test_dataset.vocab_list)
-            labels_str = labels_to_string(labels.numpy(), test_dataset.vocab_list)
-            for out_string, label in zip(*(out_strings, labels_str)):
-                # 计算字错率或者词错率
-                if self.metrics_type == 'wer':
-                    c.append(wer(out_string, label))
-                else:
-                    c.append(cer(out_string, label))
+            out_strings = self.decoder_result(outs, out_lens, test_dataset.vocab_array)
+            labels_str = labels_to_string(labels.numpy(), test_dataset.vocab_array)
+            # 计算字错率或者词错率
+            if self.metrics_type == 'wer':
+                c.extend([wer(out_string, label) for out_string, label in zip(out_strings, labels_str)])
+            else:
+                c.extend(cer(out_strings, labels_str).tolist())
         cer_result = float(sum(c) / len(c))
         return cer_result
 
@@ -205,7 +205,9 @@ class PPASRTrainer(object):
               save_model_path='models/',
               resume_model=None,
               pretrained_model=None,
-              augment_conf_path='conf/augmentation.json'):
+              augment_conf_path='conf/augmentation.json',
+              use_amp=False,
+              use_static=False):
         """
         训练模型
         :param batch_size: 训练的批量大小
@@ -217,6 +219,8 @@ class PPASRTrainer(object):
         :param resume_model: 恢复训练，当为None则不使用预训练模型
         :param pretrained_model: 预训练模型的路径，当为None则不使用预训练模型
         :param augment_conf_path: 数据增强的配置文件，为json格式
+        :param use_amp: 是否使用自动混合精度训练
+        :param use_static: 是否把模型转换为静态图训练，可以融合算子并减少Python调度开销
         """
         # 获取有多少张显卡训练
         nranks = paddle.distributed.get_world_size()
@@ -224,6 +228,9 @@ class PPASRTrainer(object):
         if local_rank == 0:
             # 日志记录器
             writer = LogWriter(logdir='log')
+        # 输入形状已经按固定长度分桶，让cuDNN为每种形状搜索并缓存最快的算法
+        if paddle.is_compiled_with_cuda():
+            paddle.set_flags({'FLAGS_cudnn_exhaustive_search': True})
         if nranks > 1:
             # 初始化Fleet环境
             fleet.init(is_collective=True)
@@ -255,10 +262,12 @@ class PPASRTrainer(object):
                                                         sortagrad=True,
                                                         drop_last=True,
                                                         shuffle=True)
+        # 读取数据的子进程在每一轮之间保持存活，避免每轮都重新创建进程和加载数据
         train_loader = DataLoader(dataset=train_dataset,
                                   collate_fn=collate_fn,
                                   batch_sampler=train_batch_sampler,
-                                  num_workers=self.num_workers)
+                                  num_workers=self.num_workers,
+                                  persistent_workers=True)
         # 获取测试数据
         test_dataset = PPASRDataset(data_list=self.test_manifest,
                                     vocab_filepath=self.dataset_vocab,
@@ -269,19 +278,32 @@ class PPASRTrainer(object):
         test_loader = DataLoader(dataset=test_dataset,
                                  batch_size=batch_size,
                                  collate_fn=collate_fn,
-                                 num_workers=self.num_workers)
+                                 num_workers=self.num_workers,
+                                 persistent_workers=True)
 
-        # 获取模型
+        # 获取模型，混合精度训练时卷积使用NHWC格式，cuDNN只有在float16时才会原生使用NHWC卷积
+        data_format = 'NHWC' if use_amp else 'NCHW'
         if self.use_model == 'deepspeech2':
-            model = deepspeech2(feat_size=train_dataset.feature_dim, vocab_size=train_dataset.vocab_size)
+            model = deepspeech2(feat_size=train_dataset.feature_dim, vocab_size=train_dataset.vocab_size,
+                                data_format=data_format)
         elif self.use_model == 'deepspeech2_big':
-            model = deepspeech2_big(feat_size=train_dataset.feature_dim, vocab_size=train_dataset.vocab_size)
+            model = deepspeech2_big(feat_size=train_dataset.feature_dim, vocab_size=train_dataset.vocab_size,
+                                    data_format=data_format)
         else:
             raise Exception('没有该模型：{}'.format(self.use_model))
         # 打印模型
         input_data = [paddle.rand([1, 161, 900], dtype=paddle.float32),
                       paddle.to_tensor(200, dtype=paddle.int64)]
         summary(net=model, input=input_data)
+        # 转换为静态图，时间维度和批量大小使用动态形状，避免每个batch都重新转换
+        if use_static:
+            build_strategy = paddle.static.BuildStrategy()
+            build_strategy.fuse_elewise_add_act_ops = True
+            build_strategy.fuse_bn_act_ops = True
+            model = paddle.jit.to_static(model,
+                                         input_spec=[InputSpec(shape=(-1, train_dataset.feature_dim, -1), dtype=paddle.float32),
+                                                     InputSpec(shape=(-1,), dtype=paddle.int64)],
+                                         build_strategy=build_strategy)
         # 设置优化方法
         grad_clip = paddle.nn.ClipGradByGlobalNorm(clip_norm=3.0)
         scheduler = paddle.optimizer.lr.ExponentialDecay(learning_rate=learning_rate, gamma=0.93)
@@ -330,10 +352,17 @@ class PPASRTrainer(object):
 
         # 获取损失函数
         ctc_loss = paddle.nn.CTCLoss(reduction='none')
+        # 混合精度训练的损失缩放
+        scaler = paddle.amp.GradScaler(init_loss_scaling=1024) if use_amp else None
+        # 支持的版本清空梯度时不写0，下一次反向传播会直接覆盖梯度
+        clear_grad_kwargs = {}
+        if 'set_to_zero' in inspect.signature(optimizer.clear_grad).parameters:
+            clear_grad_kwargs['set_to_zero'] = False
 
         test_step, train_step = 0, 0
         best_test_cer = 1
         train_times = []
+        loss_sum, loss_count = None, 0
         sum_batch = len(train_loader) * num_epoch
         train_batch_sampler.epoch = last_epoch
         if local_rank == 0:
@@ -345,25 +374,38 @@ class PPASRTrainer(object):
                 start_epoch = time.time()
                 start = time.time()
                 for batch_id, (inputs, labels, input_lens, label_lens) in enumerate(train_loader()):
-                    out, out_lens = model(inputs, input_lens)
-                    out = paddle.transpose(out, perm=[1, 0, 2])
+                    # CTC损失保持使用float32计算
+                    with paddle.amp.auto_cast(enable=use_amp, custom_black_list={'warpctc'}):
+                        out, out_lens = model(inputs, input_lens)
+                        out = paddle.transpose(out, perm=[1, 0, 2])
 
-                    # 计算损失
-                    loss = ctc_loss(out, labels, out_lens, label_lens)
-                    loss = loss.mean()
-                    loss.backward()
-                    optimizer.step()
-                    optimizer.clear_grad()
+                        # 计算损失
+                        loss = ctc_loss(out, labels, out_lens, label_lens)
+                        loss = loss.mean()
+                    if use_amp:
+                        scaled = scaler.scale(loss)
+                        scaled.backward()
+                        scaler.minimize(optimizer, scaled)
+                    else:
+                        loss.backward()
+                        optimizer.step()
+                    optimizer.clear_grad(**clear_grad_kwargs)
                     train_times.append((time.time() - start) * 1000)
                     # 多卡训练只使用一个进程打印
+                    if local_rank == 0:
+                        # 在设备上累加损失，只在打印日志时同步一次
+                        loss_sum = loss.detach() if loss_sum is None else loss_sum + loss.detach()
+                        loss_count += 1
                     if batch_id % 100 == 0 and local_rank == 0:
+                        train_loss = float(loss_sum) / loss_count
                         eta_sec = (sum(train_times) / len(train_times)) * (sum_batch - (epoch - 1) * len(train_loader) - batch_id)
                         eta_str = str(timedelta(seconds=int(eta_sec / 1000)))
                         print('[{}] Train epoch: [{}/{}], batch: [{}/{}], loss: {:.5f}, learning rate: {:>.8f}, eta: {}'.format(
-                                datetime.now(), epoch, num_epoch, batch_id, len(train_loader), loss.numpy()[0], scheduler.get_lr(), eta_str))
-                        writer.add_scalar('Train/Loss', loss, train_step)
+                                datetime.now(), epoch, num_epoch, batch_id, len(train_loader), train_loss, scheduler.get_lr(), eta_str))
+                        writer.add_scalar('Train/Loss', train_loss, train_step)
                         train_step += 1
                         train_times = []
+                        loss_sum, loss_count = None, 0
                     # 固定步数也要保存一次模型
                     if batch_id % 10000 == 0 and batch_id != 0 and local_rank == 0:
                         self.save_model(save_model_path=save_model_path, use_model=self.use_model, epoch=epoch,
@@ -375,7 +417,7 @@ class PPASRTrainer(object):
                     # 执行评估
                     model.eval()
                     print('\n', '=' * 70)
-                    c, l = self.__test(model, test_loader, test_dataset.vocab_list, ctc_loss)
+                    c, l = self.__test(model, test_loader, test_dataset.vocab_array, ctc_loss, use_amp=use_amp)
                     print('[{}] Test epoch: {}, time/epoch: {}, loss: {:.5f}, {}: {:.5f}'.format(
                         datetime.now(), epoch, str(timedelta(seconds=(time.time() - start_epoch))), l, self.metrics_type, c))
                     print('=' * 70, '\n')
@@ -404,35 +446,33 @@ class PPASRTrainer(object):
 
     # 评估模型
     @paddle.no_grad()
-    def __test(self, model, test_loader, vocabulary, ctc_loss):
+    def __test(self, model, test_loader, vocabulary, ctc_loss, use_amp=False):
         cer_result, test_loss = [], []
         for batch_id, (inputs, labels, input_lens, label_lens) in enumerate(test_loader()):
-            # 执行识别
-            outs, out_lens = model(inputs, input_lens)
-            out = paddle.transpose(outs, perm=[1, 0, 2])
-            # 计算损失
-            loss = ctc_loss(out, labels, out_lens, label_lens)
-            loss = loss.mean().numpy()[0]
+            with paddle.amp.auto_cast(enable=use_amp, custom_black_list={'warpctc'}):
+                # 执行识别
+                outs, out_lens = model(inputs, input_lens)
+                out = paddle.transpose(outs, perm=[1, 0, 2])
+                # 计算损失
+                loss = ctc_loss(out, labels, out_lens, label_lens)
+            loss = loss.mean()
             test_loss.append(loss)
-            outs = paddle.nn.functional.softmax(outs, 2)
             # 解码获取识别结果
-            out_strings = self.decoder_result(outs.numpy(), out_lens, vocabulary)
+            out_strings = self.decoder_result(outs, out_lens, vocabulary)
             labels_str = labels_to_string(labels.numpy(), vocabulary)
-            cer_batch = []
-            for out_string, label in zip(*(out_strings, labels_str)):
-                # 计算字错率或者词错率
-                if self.metrics_type == 'wer':
-                    c = wer(out_string, label)
-                else:
-                    c = cer(out_string, label)
-                cer_result.append(c)
-                cer_batch.append(c)
+            # 计算字错率或者词错率
+            if self.metrics_type == 'wer':
+                cer_batch = [wer(out_string, label) for out_string, label in zip(out_strings, labels_str)]
+            else:
+                cer_batch = cer(out_strings, labels_str).tolist()
+            cer_result.extend(cer_batch)
             if batch_id % 10 == 0:
                 print('[{}] Test batch: [{}/{}], loss: {:.5f}, '
-                      '{}: {:.5f}'.format(datetime.now(), batch_id, len(test_loader),loss,self.metrics_type,
+                      '{}: {:.5f}'.format(datetime.now(), batch_id, len(test_loader), float(loss), self.metrics_type,
                                           float(sum(cer_batch) / len(cer_batch))))
         cer_result = float(sum(cer_result) / len(cer_result))
-        test_loss = float(sum(test_loss) / len(test_loss))
+        # 全部损失留在设备上，最后只同步一次
+        test_loss = float(paddle.stack(test_loss).mean())
         return cer_result, test_loss
 
     # 保存模型
@@ -462,29 +502,46 @@ class PPASRTrainer(object):
 
     def decoder_result(self, outs, outs_lens, vocabulary):
         # 集束搜索方法的处理
-        if self.decoder == "ctc_beam_search" and self.beam_search_decoder is None:
+        if self.decoder in ["ctc_beam_search", "ctc_beam_search_batch"] and self.beam_search_decoder is None:
             try:
                 from ppasr.decoders.beam_search_decoder import BeamSearchDecoder
-                self.beam_search_decoder = BeamSearchDecoder(self.alpha, self.beta, self.lang_model_path, vocabulary)
+                self.beam_search_decoder = BeamSearchDecoder(self.alpha, self.beta, self.lang_model_path, list(vocabulary))
             except ModuleNotFoundError:
                 print('\n==================================================================', file=sys.stderr)
                 print('缺少 paddlespeech-ctcdecoders 库，请安装，如果是Windows系统，只能使用ctc_greedy。', file=sys.stderr)
                 print('【注意】已自动切换为ctc_greedy解码器。', file=sys.stderr)
                 print('==================================================================\n', file=sys.stderr)
                 self.decoder = 'ctc_greedy'
+        if self.decoder == "ctc_beam_search_batch" and not self.beam_search_decoder.support_batch_paddle:
+            print('\n==================================================================', file=sys.stderr)
+            print('ctc_beam_search_batch只支持字符级的语言模型。', file=sys.stderr)
+            print('【注意】已自动切换为ctc_beam_search解码器。', file=sys.stderr)
+            print('==================================================================\n', file=sys.stderr)
+            self.decoder = 'ctc_beam_search'
 
         # 执行解码
-        outs = [outs[i, :l, :] for i, l in enumerate(outs_lens)]
         if self.decoder == 'ctc_greedy':
-            result = greedy_decoder_batch(outs, vocabulary)
+            result = greedy_decoder_paddle(outs, outs_lens, vocabulary)
+        elif self.decoder == 'ctc_beam_search_batch':
+            # 集束搜索直接在设备上对整个批次解码
+            log_probs = paddle.nn.functional.log_softmax(outs, axis=-1)
+            result = self.beam_search_decoder.decode_batch_beam_search_paddle(log_probs=log_probs,
+                                                                              log_probs_lens=outs_lens,
+                                                                              beam_alpha=self.alpha,
+                                                                              beam_beta=self.beta,
+                                                                              beam_size=self.beam_size,
+                                                                              cutoff_prob=self.cutoff_prob,
+                                                                              cutoff_top_n=self.cutoff_top_n)
         else:
+            outs = paddle.nn.functional.softmax(outs, 2).numpy()
+            outs = [outs[i, :l, :] for i, l in enumerate(outs_lens.numpy())]
             result = self.beam_search_decoder.decode_batch_beam_search(probs_split=outs,
                                                                        beam_alpha=self.alpha,
                                                                        beam_beta=self.beta,
                                                                        beam_size=self.beam_size,
                                                                        cutoff_prob=self.cutoff_prob,
                                                                        cutoff_top_n=self.cutoff_top_n,
-                                                                       vocab_list=vocabulary,
+                                                                       vocab_list=list(vocabulary),
                                                                        num_processes=self.num_proc_bsearch)
         return result
 
@@ -1,16 +1,23 @@
 import Levenshtein as Lev
+import numpy as np
 
 
 def cer(prediction, label):
     """
-   通过计算两个字符串的距离，得出字错率
+   通过计算两个字符串的距离，得出字错率，也可以传入一批字符串一次计算整批的字错率
 
     Arguments:
-        prediction (string): 比较的字符串
-        label (string): 比较的字符串
+        prediction (string|list): 比较的字符串或者字符串列表
+        label (string|list): 比较的字符串或者字符串列表
     """
-    prediction, label, = prediction.replace(" ", ""), label.replace(" ", "")
-    return Lev.distance(prediction, label) / float(len(label))
+    if isinstance(prediction, str):
+        prediction, label, = prediction.replace(" ", ""), label.replace(" ", "")
+        return Lev.distance(prediction, label) / float(len(label))
+    predictions = [p.replace(" ", "") for p in prediction]
+    labels = [l.replace(" ", "") for l in label]
+    dists = np.fromiter(map(Lev.distance, predictions, labels), dtype=np.int32, count=len(labels))
+    lens = np.fromiter(map(len, labels), dtype=np.int32, count=len(labels))
+    return dists / lens
 
 
 def wer(prediction, label):
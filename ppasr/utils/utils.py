@@ -29,10 +29,12 @@ def add_arguments(argname, type, default, help, argparser, **kwargs):
 
 
 def labels_to_string(label, vocabulary, blank_index=0):
+    # 使用numpy的索引一次取出一条数据的全部字符
+    vocabulary = np.asarray(vocabulary, dtype=object)
     labels = []
     for l in label:
-        index_list = [index for index in l if index != blank_index and index != -1]
-        labels.append((''.join([vocabulary[index] for index in index_list])).replace('<space>', ' '))
+        index_list = l[(l != blank_index) & (l != -1)]
+        labels.append((''.join(vocabulary[index_list])).replace('<space>', ' '))
     return labels
 
 
@@ -174,17 +176,14 @@ def create_noise(path, noise_manifest_path, min_duration=30, is_change_frame_rat
 
 # 获取全部字符
 def count_manifest(counter, manifest_path):
-    with open(manifest_path, 'r', encoding='utf-8') as f:
-        for line in tqdm(f.readlines()):
-            line = json.loads(line)
-            for char in line["text"].replace('\n', ''):
-                counter.update(char)
+    manifest_paths = [manifest_path]
     if os.path.exists(manifest_path.replace('train', 'test')):
-        with open(manifest_path.replace('train', 'test'), 'r', encoding='utf-8') as f:
-            for line in tqdm(f.readlines()):
-                line = json.loads(line)
-                for char in line["text"].replace('\n', ''):
-                    counter.update(char)
+        manifest_paths.append(manifest_path.replace('train', 'test'))
+    for path in manifest_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts = [json.loads(line)["text"] for line in tqdm(f.readlines())]
+        # 拼接全部文本后一次统计
+        counter.update(''.join(texts).replace('\n', ''))
 
 
 # 计算数据集的均值和标准值
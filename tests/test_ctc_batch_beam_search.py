@@ -0,0 +1,154 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+paddle = pytest.importorskip('paddle')
+
+from ppasr.decoders.ctc_batch_beam_search import BatchedCTCBeamSearch, _log_add as _paddle_log_add
+
+VOCAB = ['<blank>', 'a', 'b', 'c', 'd']
+
+
+class NgramScorer(object):
+    """测试用的字符级语言模型，得分只和前面order - 1个字符有关"""
+
+    def __init__(self, order=2):
+        self.order = order
+        self.calls = 0
+
+    def is_character_based(self):
+        return True
+
+    def get_max_order(self):
+        return self.order
+
+    def get_log_cond_prob(self, words):
+        self.calls += 1
+        assert len(words) == self.order
+        char = words[-1]
+        return sum(-0.1 * (abs(ord(prev[0]) - ord(char[0])) % 5) * (i + 1)
+                   for i, prev in enumerate(words[:-1])) - 0.2
+
+
+def _log_add(a, b):
+    if a == -math.inf:
+        return b
+    if b == -math.inf:
+        return a
+    m = max(a, b)
+    return m + math.log(math.exp(a - m) + math.exp(b - m))
+
+
+def _reference_decode(log_probs, beam_size, alpha=0., beta=0., scorer=None, cutoff_prob=1.0, cutoff_top_n=40):
+    """逐条数据、逐个前缀执行的CTC前缀集束搜索，和swig解码器的流程相同"""
+    beams = {(): (0., -math.inf)}
+    for lp in log_probs:
+        order = np.argsort(-lp)
+        if cutoff_prob < 1.0 or cutoff_top_n < len(lp):
+            kept, cum = [], 0.
+            for c in order[:cutoff_top_n]:
+                kept.append(c)
+                cum += math.exp(lp[c])
+                if cum >= cutoff_prob:
+                    break
+        else:
+            kept = list(order)
+        next_beams = defaultdict(lambda: [-math.inf, -math.inf])
+        for prefix, (pb, pnb) in beams.items():
+            total = _log_add(pb, pnb)
+            for c in kept:
+                if c == 0:
+                    next_beams[prefix][0] = _log_add(next_beams[prefix][0], total + lp[c])
+                    continue
+                if prefix and prefix[-1] == c:
+                    next_beams[prefix][1] = _log_add(next_beams[prefix][1], pnb + lp[c])
+                    score = pb + lp[c]
+                else:
+                    score = total + lp[c]
+                if scorer is not None:
+                    context = [VOCAB[i] for i in prefix[max(len(prefix) - scorer.order + 1, 0):]]
+                    ngram = ['<s>'] * (scorer.order - 1 - len(context)) + context + [VOCAB[c]]
+                    score += alpha * scorer.get_log_cond_prob(ngram) + beta
+                new_prefix = prefix + (c,)
+                next_beams[new_prefix][1] = _log_add(next_beams[new_prefix][1], score)
+        ranked = sorted(next_beams.items(), key=lambda x: _log_add(*x[1]), reverse=True)[:beam_size]
+        beams = {prefix: tuple(p) for prefix, p in ranked}
+    best = max(beams.items(), key=lambda x: _log_add(*x[1]))[0]
+    return ''.join(VOCAB[c] for c in best)
+
+
+def _log_probs(batch_size, max_len, seed=0):
+    rng = np.random.RandomState(seed)
+    logits = rng.randn(batch_size, max_len, len(VOCAB)).astype('float32') * 2
+    logits -= logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def test_log_add_negative_infinity():
+    # 足够长的张量会走向量化的exp，两个都是-inf时结果也必须是-inf，否则无效的集束会被当成有效的前缀
+    neg_inf = paddle.full([2, 16], float('-inf'), dtype=paddle.float32)
+    assert np.isneginf(_paddle_log_add(neg_inf, neg_inf).numpy()).all()
+    result = _paddle_log_add(neg_inf, paddle.zeros([2, 16], dtype=paddle.float32)).numpy()
+    assert np.allclose(result, 0.)
+
+
+def test_merge_equal_prefixes():
+    # 单条最优路径是"b a"，但"a a"、"a _"和"_ a"都折叠为"a"，合并后"a"的概率最大
+    probs = np.array([[0.05, 0.45, 0.5, 0., 0.],
+                      [0.3, 0.45, 0.25, 0., 0.]], dtype='float32')
+    log_probs = np.log(probs + 1e-30)[None]
+    decoder = BatchedCTCBeamSearch(VOCAB)
+    result = decoder.decode(paddle.to_tensor(log_probs), paddle.to_tensor([2]),
+                            beam_alpha=0., beam_beta=0., beam_size=4)
+    assert result == ['a']
+    assert result[0] == _reference_decode(log_probs[0], beam_size=4)
+
+
+@pytest.mark.parametrize('beam_size, cutoff_prob, cutoff_top_n', [(3, 1.0, 40), (8, 1.0, 40), (8, 0.9, 3)])
+def test_matches_reference(beam_size, cutoff_prob, cutoff_top_n):
+    log_probs = _log_probs(4, 12)
+    lens = [12, 9, 5, 1]
+    decoder = BatchedCTCBeamSearch(VOCAB)
+    results = decoder.decode(paddle.to_tensor(log_probs), paddle.to_tensor(lens), beam_alpha=0., beam_beta=0.,
+                             beam_size=beam_size, cutoff_prob=cutoff_prob, cutoff_top_n=cutoff_top_n)
+    expected = [_reference_decode(lp[:l], beam_size, cutoff_prob=cutoff_prob, cutoff_top_n=cutoff_top_n)
+                for lp, l in zip(log_probs, lens)]
+    assert results == expected
+
+
+@pytest.mark.parametrize('order, alpha, beta', [(2, 1.5, 0.3), (2, 2.2, 4.3), (3, 2.2, 4.3)])
+def test_language_model_matches_reference(order, alpha, beta):
+    log_probs = _log_probs(3, 10, seed=1)
+    lens = [10, 7, 4]
+    scorer = NgramScorer(order)
+    decoder = BatchedCTCBeamSearch(VOCAB, ext_scorer=scorer)
+    results = decoder.decode(paddle.to_tensor(log_probs), paddle.to_tensor(lens),
+                             beam_alpha=alpha, beam_beta=beta, beam_size=6)
+    expected = [_reference_decode(lp[:l], 6, alpha=alpha, beta=beta, scorer=NgramScorer(order))
+                for lp, l in zip(log_probs, lens)]
+    assert results == expected
+
+
+def test_word_based_language_model_is_rejected():
+    class WordScorer(NgramScorer):
+        def is_character_based(self):
+            return False
+
+    with pytest.raises(ValueError):
+        BatchedCTCBeamSearch(VOCAB, ext_scorer=WordScorer())
+
+
+def test_matches_swig_decoder():
+    pytest.importorskip('swig_decoders')
+    from ppasr.decoders.swig_wrapper import ctc_beam_search_decoder
+
+    log_probs = _log_probs(2, 10, seed=2)
+    decoder = BatchedCTCBeamSearch(VOCAB)
+    results = decoder.decode(paddle.to_tensor(log_probs), paddle.to_tensor([10, 10]),
+                             beam_alpha=0., beam_beta=0., beam_size=10, cutoff_prob=1.0, cutoff_top_n=40)
+    for lp, result in zip(log_probs, results):
+        expected = ctc_beam_search_decoder(probs_seq=np.exp(lp), vocabulary=VOCAB, beam_size=10,
+                                           cutoff_prob=1.0, cutoff_top_n=40, blank_id=0)
+        assert result == expected[0][1]
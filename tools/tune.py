@@ -86,9 +86,10 @@ def tune():
     for inputs, label, input_lens, _ in tqdm(test_loader()):
         used_sum += inputs.shape[0]
         # 执行识别
-        outs, _ = model(inputs, input_lens)
-        outs = paddle.nn.functional.softmax(outs, 2)
-        outputs.append(outs.numpy())
+        outs, out_lens = model(inputs, input_lens)
+        outs = paddle.nn.functional.softmax(outs, 2).numpy()
+        # 去掉填充部分的输出
+        outputs.append([outs[i, :l] for i, l in enumerate(out_lens.numpy())])
         labels.append(label.numpy())
         if args.num_data != -1 and used_sum >= args.num_data:break
 
@@ -23,6 +23,8 @@ add_arg('feature_method',   str,    'linear',                   '音频预处理
 add_arg('metrics_type',     str,    'cer',                      '计算错误率方法', choices=['cer', 'wer'])
 add_arg('resume_model',     str,    None,                       '恢复训练，当为None则不使用预训练模型')
 add_arg('pretrained_model', str,    None,                       '预训练模型的路径，当为None则不使用预训练模型')
+add_arg('use_amp',          bool,   False,                      '是否使用自动混合精度训练')
+add_arg('use_static',       bool,   False,                      '是否使用静态图训练')
 args = parser.parse_args()
 print_arguments(args)
 
@@ -43,4 +45,6 @@ trainer.train(batch_size=args.batch_size,
               save_model_path=args.save_model_path,
               resume_model=args.resume_model,
               pretrained_model=args.pretrained_model,
-              augment_conf_path=args.augment_conf_path)
+              augment_conf_path=args.augment_conf_path,
+              use_amp=args.use_amp,
+              use_static=args.use_static)